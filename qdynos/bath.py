@@ -84,10 +84,18 @@ class Bath(object):
 
     Uses clever code from pyrho - https://github.com/berkelbach-group/pyrho
 
+    omega may be a scalar or an array of frequencies. For arrays the
+    transform is evaluated once per unique frequency and broadcast back to
+    the shape of omega, so subclasses only need to support scalars.
+
     Notes
     -----
     \int_0^{\infty} ds e^{i omega s} C(s)
     """
+    if np.ndim(omega) > 0:
+      freqs,inds = np.unique(omega, return_inverse=True)
+      ft = np.array([self.ft_bath_corr(w) for w in freqs], dtype=complex)
+      return ft[inds].reshape(np.shape(omega))
     ppv = quad(self.real_bath_corr, -self.omega_inf, self.omega_inf,
            limit=1000, weight='cauchy', wvar=omega)
     ppv = -ppv[0]
@@ -104,7 +112,14 @@ class Bath(object):
     where,
 
     C(s) = \int_0^{\infty} d\omega J(\omega) [(2n(\omega)+1) \cos(\omega t) - i \sin(\omega t)]
+
+    t may be a scalar or an array of times, arrays are handled as in
+    ft_bath_corr.
     """
+    if np.ndim(t) > 0:
+      taus,inds = np.unique(t, return_inverse=True)
+      ct = np.array([self.bath_corr_t(tau) for tau in taus], dtype=complex)
+      return ct[inds].reshape(np.shape(t))
     def bath_corr_bose(w):
       if w==0:
         return self.J0*self.kT
@@ -1,4 +1,6 @@
 import numpy as np
+import scipy.sparse as sp
+from scipy.linalg import eigh
 import qdynos.constants as const
 
 from .utils import dag,is_hermitian,is_vector,is_matrix
@@ -8,32 +10,46 @@ class Hamiltonian(object):
   """Base Hamiltonian class.
   """
 
-  def __init__(self, H, eig=True, nstates=None, baths=None, units='au', convert=None):
+  def __init__(self, H, eig=True, nstates=None, baths=None, units='au', convert=None,
+               nkeep=None):
     """
     Parameters
     ----------
-    H: np.ndarray
-      Hamiltonian matrix
+    H: np.ndarray or scipy.sparse matrix
+      Hamiltonian matrix, sparse matrices are stored as csr and are never
+      diagonalized
     nstates: int
       Number that specifies the size of Hilbert space
     bath: list of Bath classes
       Baths that independently couple to the system
     units: string
     TODO convert: bool?
+    nkeep: int
+      Only compute the lowest nkeep eigenpairs, defaults nstates to nkeep.
+      from_eigenbasis then returns full site-basis operators
     """
     # TODO want this to be a setter, but whatever
     self.units = units
     const.hbar = const.get_hbar(units)
     # TODO add unit conversion here
+    self.nkeep = nkeep
     if nstates==None:
-      self.nstates = H.shape[0]
+      if nkeep==None:
+        self.nstates = H.shape[0]
+      else:
+        self.nstates = nkeep
     else:
       self.nstates = nstates
-    self.check_hermiticity(H)
-    self.ham = H
+    assert(self.nkeep==None or self.nkeep>=self.nstates)
+    self.is_sparse = sp.issparse(H)
+    if self.is_sparse:
+      self.ham = sp.csr_matrix(H)
+    else:
+      self.ham = H
+    self.check_hermiticity(self.ham)
     self.baths = baths
     if self.baths != None: self.nbaths = len(self.baths)
-    if eig:
+    if eig and not self.is_sparse:
       self.eigensystem()
     
   def __repr__(self):
@@ -52,8 +68,18 @@ class Hamiltonian(object):
 
   def eigensystem(self):
     """Computes eigenvalues and eigenvectors of Hamiltonian."""
-    self.ev,self.ek = np.linalg.eigh(self.ham)
+    if self.is_sparse:
+      raise NotImplementedError("Full diagonalization of a sparse Hamiltonian")
+    if self.nkeep==None:
+      subset = None
+    else:
+      subset = (0,self.nkeep-1)
+    self.ev,self.ek = eigh(self.ham, driver='evr', check_finite=False,
+                           subset_by_index=subset)
+    self.ekdag = np.ascontiguousarray(dag(self.ek))
     self.ev = self.ev[:self.nstates]
+    self._ev_col = self.ev[:,None]
+    self._ev_row = self.ev[None,:]
     self.compute_frequencies()
 
   def compute_frequencies(self):
@@ -62,9 +88,7 @@ class Hamiltonian(object):
       self.ev
     except:
       self.eigensystem()
-    # TODO use map or pool for this
-    self.omegas = np.array([[(self.ev[i]-self.ev[j]) for j in range(self.nstates)]
-                  for i in range(self.nstates)])/const.hbar
+    self.omegas = (self.ev[:,None] - self.ev[None,:])/const.hbar
 
   def compute_unique_freqs(self):
     """Computes unique frequencies of Hamiltonian."""
@@ -80,10 +104,11 @@ class Hamiltonian(object):
       self.ek
     except:
       self.compute_frequencies()
+    n = self.nstates
     if is_vector(op):
-      return np.dot(dag(self.ek), op)[:self.nstates,:]
+      return np.matmul(self.ekdag[:n,:], op)
     elif is_matrix(op):
-      return np.dot(dag(self.ek), np.dot(op, self.ek))[:self.nstates,:self.nstates]
+      return np.matmul(self.ekdag[:n,:], np.dot(op, self.ek[:,:n]))
     else:
       raise AttributeError("Not a valid operator")
 
@@ -93,16 +118,27 @@ class Hamiltonian(object):
       self.ek
     except:
       self.compute_frequencies()
+    n = self.nstates
+    if self.nkeep != None:
+      # only the lowest eigenvectors are known, project back onto the full
+      # site basis
+      if is_vector(op):
+        return np.matmul(self.ek[:,:n], op)
+      elif is_matrix(op):
+        return np.matmul(self.ek[:,:n], np.dot(op, self.ekdag[:n,:]))
+      else:
+        raise AttributeError("Not a valid operator")
     if is_vector(op):
-      return np.dot(self.ek, op)[:self.nstates,:]
+      return np.matmul(self.ek[:n,:], op)
     elif is_matrix(op):
-      return np.dot(self.ek, np.dot(op, dag(self.ek)))[:self.nstates,:self.nstates]
+      return np.matmul(self.ek[:n,:], np.dot(op, self.ekdag[:,:n]))
     else:
       raise AttributeError("Not a valid operator")
 
   def commutator(self, op, eig=True):
     if eig:
-      return self.Heig@op - op@self.Heig
+      # H is diagonal in the eigenbasis, so scale rows and columns
+      return self._ev_col*op - op*self._ev_row
     else:
       return self.ham@op - op@self.ham
 
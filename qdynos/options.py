@@ -13,7 +13,8 @@ class Options(object):
                traj_states_file=None,traj_states_every=1, block_avg=False, nblocks=10,
                jump_time_steps=1000, jump_time_tol=1.e-3, seed=None, 
                markov_time=np.inf, unraveling=False, which_unraveling='jump', 
-               restart_file=None, restart=False):
+               restart_file=None, restart=False, dtype=np.complex128,
+               adaptive=False, atol=1.e-8, rtol=1.e-6):
 
     # program run options #
     self.verbose = verbose
@@ -23,6 +24,14 @@ class Options(object):
     # integrator options #
     assert(method in ['euler','rk4','exact','lanczos','arnoldi'])
     self.method = method
+    # precision of the propagated state, e.g. np.complex64 for small
+    # well-conditioned Redfield problems
+    self.dtype = dtype
+    # adaptive step size (LSODA) for time-independent Redfield, the state
+    # is only reported at the requested times
+    self.adaptive = adaptive
+    self.atol = atol
+    self.rtol = rtol
 
     # unitary evolution options #
     # TODO check default, that might be a bit ridiculous
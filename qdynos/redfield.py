@@ -3,16 +3,50 @@ from __future__ import print_function,absolute_import
 import numpy as np
 from time import time
 from scipy.linalg import expm
+from scipy.integrate import solve_ivp
+from numba import jit
 
 import qdynos.constants as const
 
 from .integrator import Integrator
 from .dynamics import Dynamics
-from .utils import commutator,dag,matmult,to_liouville,from_liouville
+from .utils import dag,matmult,to_liouville,from_liouville
 from .options import Options
 from .results import Results
 from .log import *
 
+@jit(nopython=True, cache=True, fastmath=True)
+def rf_matmul(A, B):
+  """Complex matrix product. For a handful of states explicit loops beat the
+  overhead of a BLAS call."""
+  n = A.shape[0]
+  if n > 4:
+    return np.dot(A, B)
+  C = np.zeros((n,n), dtype=A.dtype)
+  for i in range(n):
+    for k in range(n):
+      a = A[i,k]
+      for j in range(n):
+        C[i,j] += a*B[k,j]
+  return C
+
+@jit(nopython=True, cache=True, fastmath=True)
+def rf_kernel(iomegas, state, Cs, Es, Esdag):
+  """Redfield equation of motion in the energy eigenbasis. iomegas is
+  -i*omegas and Es and Esdag are expected to carry the 1/hbar^2 prefactor
+  already. All arrays share the dtype of state.
+
+  Notes
+  -----
+  (-i/hbar)[H, rho] = -i omega_ij rho_ij
+  [E rho, C] + [C, rho E^+] = [E rho - rho E^+, C]
+  """
+  dy = iomegas*state
+  for j in range(Cs.shape[0]):
+    X = rf_matmul(Es[j], state) - rf_matmul(state, Esdag[j])
+    dy += rf_matmul(X, Cs[j]) - rf_matmul(Cs[j], X)
+  return dy
+
 class Redfield(Dynamics):
   """Dynamics class for Redfield-like dynamics. Can perform both 
   time-dependent (TCL2) and time-independent dynamics with and without the 
@@ -56,7 +90,8 @@ class Redfield(Dynamics):
   def setup(self, times, results):
     """
     """
-    self.dt = times[1]-times[0]
+    # python float so that the step keeps the precision of the state
+    self.dt = float(times[1]-times[0])
     self.tobs = len(times)
     if results==None:
       self.results = Results()
@@ -164,19 +199,14 @@ class Redfield(Dynamics):
       else:
         self.C = list()
         self.E = list()
+        self.Edag = list()
     elif self.options.space == "liouville":
       gamma_plus  = np.zeros((nstates,nstates,nstates,nstates),dtype=complex)
       gamma_minus = np.zeros((nstates,nstates,nstates,nstates),dtype=complex)
     for k,bath in enumerate(self.ham.baths):
       if self.options.really_verbose: print_basic("operator %d of %d"%(k+1,len(self.ham.baths)))
       Ga = self.ham.to_eigenbasis( bath.c_op )
-      theta_zero = bath.ft_bath_corr(0.0)
-      theta_plus = theta_zero*np.identity(nstates,dtype=complex)
-      for i in range(nstates):
-        if self.options.really_verbose: print_basic("%d rows of %d"%(i,nstates))
-        for j in range(nstates):
-          if i!=j:
-            theta_plus[i,j] = bath.ft_bath_corr(-self.ham.omegas[i,j])
+      theta_plus = bath.ft_bath_corr(-self.ham.omegas)
       if self.options.space == "hilbert":
         if self.is_secular:
           if self.options.print_coup_ops:
@@ -196,6 +226,7 @@ class Redfield(Dynamics):
           Ga_plus = Ga*theta_plus
           self.C.append(Ga.copy())
           self.E.append(Ga_plus.copy())
+          self.Edag.append(dag(Ga_plus))
           if self.options.print_coup_ops:
             np.save(self.options.coup_ops_file+"c_op_%d"%(k),self.C[k])
             np.save(self.options.coup_ops_file+"e_op_%d"%(k),self.E[k])
@@ -215,6 +246,8 @@ class Redfield(Dynamics):
         if self.options.print_coup_ops:
           np.save(self.options.coup_ops_file+"prop.npy",self.prop)
           np.save(self.options.coup_ops_file+"Rdep.npy",self.Rdep)
+      else:
+        self.stack_rf_operators()
     elif self.options.space == "liouville":
       self.R = (gamma_plus.transpose(2,1,3,0) + gamma_minus.transpose(2,1,3,0) -\
            np.einsum('lj,irrk->ijkl', np.identity(nstates), gamma_plus) -\
@@ -237,37 +270,27 @@ class Redfield(Dynamics):
     """
     self.C = []
     self.gamma_n = [[]]*self.ham.nbaths
-    self.gamma_n_1 = [[]]*self.ham.nbaths
     nstates = self.ham.nstates
-    b = self.ode.b
 
+    # integration grid of the dressing in units of dt and trapezoid weight
+    if self.options.method == "exact":
+      self.tcl2_b = np.array([0.0, 1.0])
+      self.tcl2_weight = 1.0
+    else:
+      self.tcl2_b = np.array(self.ode.b)
+      self.tcl2_weight = 0.5
+    # phases of the grid points relative to the start of a time step
+    self.tcl2_phase_step = np.exp(-1.j*self.ham.omegas[None,:,:]*self.tcl2_b[:,None,None]*self.dt)
+    self.tcl2_time = 0.0
+    self.tcl2_phase = np.ones((nstates,nstates),dtype=complex)
+
+    phase = self.tcl2_phases(0.0)
     for op,bath in enumerate(self.ham.baths):
       self.C.append( self.ham.to_eigenbasis( bath.c_op ) )
       if self.options.print_coup_ops:
         np.save(self.options.coup_ops_file+"c_op_%d"%(op),self.C[op])
-      self.gamma_n[op] = list()
-      self.gamma_n_1[op] = list()
-
-    if self.options.method == "exact":
-      for op,bath in enumerate(self.ham.baths):
-        self.gamma_n[op].append( np.zeros((nstates,nstates),dtype=complex) )
-        theta_plus = np.exp(-1.j*self.ham.omegas*0.0)*bath.bath_corr_t(0.0)
-        self.gamma_n_1[op].append(theta_plus.copy())
-        theta_plus = np.exp(-1.j*self.ham.omegas*self.dt)*bath.bath_corr_t(self.dt)
-        self.gamma_n[op].append( self.gamma_n[op][0] + self.dt*(theta_plus + self.gamma_n_1[op][0]) )
-        self.gamma_n_1[op].append( theta_plus.copy() )
-    else:
-      for op,bath in enumerate(self.ham.baths):
-        for k in range(self.ode.order):
-          t = b[k]*self.dt
-          if k==0:
-            self.gamma_n[op].append( np.zeros((nstates,nstates),dtype=complex) )
-            theta_plus = np.exp(-1.j*self.ham.omegas*0.0)*bath.bath_corr_t(0.0)
-            self.gamma_n_1[op].append(theta_plus.copy())
-          else:
-            theta_plus = np.exp(-1.j*self.ham.omegas*t)*bath.bath_corr_t(t)
-            self.gamma_n[op].append( self.gamma_n[op][k-1] + 0.5*(b[k]-b[k-1])*self.dt*(theta_plus + self.gamma_n_1[op][k-1]) )
-            self.gamma_n_1[op].append( theta_plus.copy() )
+      gamma_0 = np.zeros((nstates,nstates),dtype=complex)
+      self.integrate_dressing(op, bath, 0.0, gamma_0, phase)
     if self.options.space == "liouville":
       self.Omega = -1.j*np.einsum('ij,ik,jl->ijkl', self.ham.omegas,
                    np.identity(nstates), np.identity(nstates))
@@ -277,34 +300,37 @@ class Redfield(Dynamics):
         self.prop_n_1 = np.zeros((nstates,nstates))
         self.Rdep_n_1 = np.zeros((nstates,nstates),dtype=complex)
 
+  def tcl2_phases(self, time):
+    """Phases exp(-i omega t) on the integration grid of the step starting at
+    time. Stepping forward by dt advances the stored phase with one
+    multiplication instead of a new complex exponential.
+    """
+    if abs(time - (self.tcl2_time + self.dt)) < 1.e-6*self.dt:
+      self.tcl2_phase *= self.exp_omega_step
+    elif abs(time - self.tcl2_time) > 1.e-6*self.dt:
+      self.tcl2_phase = np.exp(-1.j*self.ham.omegas*time)
+    self.tcl2_time = time
+    return self.tcl2_phase[None,:,:]*self.tcl2_phase_step
+
+  def integrate_dressing(self, op, bath, time, gamma_0, phase):
+    """Trapezoid integration of the dressing of a coupling operator over one
+    time step, evaluated on every point of the integration grid at once.
+    self.gamma_n[op] is stored as a (len(grid), nstates, nstates) array.
+    """
+    t = time + self.tcl2_b*self.dt
+    theta_plus = phase*bath.bath_corr_t(t)[:,None,None]
+    dgamma = np.zeros_like(theta_plus)
+    dt_k = self.tcl2_weight*self.dt*np.diff(self.tcl2_b)
+    dgamma[1:] = dt_k[:,None,None]*(theta_plus[1:] + theta_plus[:-1])
+    self.gamma_n[op] = gamma_0 + np.cumsum(dgamma, axis=0)
+
   def make_tcl2_operators(self, time):
     """Integrate "dressing" for copuling operators. Uses trapezoid rule 
     with grid of integration method (e.g., Runge-Kutta 4).
     """
-    if self.options.method == 'exact':
-      for op,bath in enumerate(self.ham.baths):
-        # t
-        t = time
-        theta_plus = np.exp(-1.j*self.ham.omegas*t)*bath.bath_corr_t(t)
-        self.gamma_n[op][0] = self.gamma_n[op][-1].copy()
-        self.gamma_n_1[op][0] = theta_plus.copy()
-        # t + dt
-        t = time + self.dt
-        theta_plus = np.exp(-1.j*self.ham.omegas*t)*bath.bath_corr_t(t)
-        self.gamma_n_1[op][-1] = theta_plus.copy()
-        self.gamma_n[op][-1] = self.gamma_n[op][0] + self.dt*(theta_plus + self.gamma_n_1[op][0])
-    else:
-      b = self.ode.b
-      for op,bath in enumerate(self.ham.baths):
-        for k in range(self.ode.order):
-          t = time + b[k]*self.dt
-          theta_plus = np.exp(-1.j*self.ham.omegas*t)*bath.bath_corr_t(t)
-          if k==0:
-            self.gamma_n[op][k] = self.gamma_n[op][-1].copy()
-            self.gamma_n_1[op][k] = theta_plus.copy()
-          else:
-            self.gamma_n[op][k] = self.gamma_n[op][k-1] + 0.5*self.dt*(b[k]-b[k-1])*(theta_plus + self.gamma_n_1[op][k-1])
-            self.gamma_n_1[op][k] = theta_plus.copy()
+    phase = self.tcl2_phases(time)
+    for op,bath in enumerate(self.ham.baths):
+      self.integrate_dressing(op, bath, time, self.gamma_n[op][-1], phase)
 
   def update_ops(self, time):
     """Update the dressed coupling operators by integrating Fourier-Laplace
@@ -332,9 +358,9 @@ class Redfield(Dynamics):
             self.prop_n[i,i] = 0.0
             self.prop_n[i,i] -= np.sum(self.prop_n[:,i])
           self.Rdep_n -= self.Rdep_n*np.eye(nstates)
-          self.prop = expm(self.prop_n-self.prop_n_1)
+          self.prop = expm(self.prop_n-self.prop_n_1).astype(self.options.dtype)
           self.prop_n_1 = self.prop_n.copy()
-          self.Rdep = np.exp(self.dt*(-1.j*self.ham.omegas + (self.Rdep_n-self.Rdep_n_1)/const.hbar**2./self.dt))
+          self.Rdep = (self.exp_omega_step*np.exp((self.Rdep_n-self.Rdep_n_1)/const.hbar**2.)).astype(self.options.dtype)
           self.Rdep_n_1 = self.Rdep_n.copy()
         else:
           self.prop = list()
@@ -357,14 +383,15 @@ class Redfield(Dynamics):
               prop_n[j,j] = 0.0
               prop_n[j,j] -= np.sum(prop_n[:,j])
             Rdep_n -= Rdep_n*np.eye(nstates)
-            self.prop.append( prop_n.copy() )
-            self.Rdep.append( Rdep_n.copy() )
+            self.prop.append( prop_n.astype(self.options.dtype) )
+            self.Rdep.append( Rdep_n.astype(self.options.dtype) )
       else:
         self.E = [[]]*self.ham.nbaths
+        self.Edag = [[]]*self.ham.nbaths
         for i in range(len(self.C)):
-          self.E[i] = list()
-          for j in range(self.ode.order):
-            self.E[i].append(self.gamma_n[i][j]*self.C[i])
+          self.E[i] = self.gamma_n[i]*self.C[i]
+          self.Edag[i] = self.E[i].conj().transpose(0,2,1)
+        self.stack_rf_operators()
     elif self.options.space == "liouville":
       nstates = self.ham.nstates
       self.prop = list()
@@ -385,7 +412,7 @@ class Redfield(Dynamics):
                   if abs(self.ham.omegas[j,k]
                        -self.ham.omegas[l,m]) > 1e-6:
                     R[j,k,l,m] = 0.0
-        self.prop.append( self.Omega + to_liouville(R.copy())/const.hbar**2. )
+        self.prop.append( (self.Omega + to_liouville(R.copy())/const.hbar**2.).astype(self.options.dtype) )
     if time < self.options.markov_time:
       self.make_tcl2_operators(time)
 
@@ -395,34 +422,64 @@ class Redfield(Dynamics):
   def super_rf_eom(self, state, order):
     return matmult(self.prop , state)
 
+  def stack_rf_operators(self):
+    """Stack the coupling operators into contiguous arrays for rf_kernel.
+    Time-dependent operators are stacked as (order, nbaths, nstates, nstates)
+    so that each integrator stage is contiguous. The dressed operators are
+    scaled by 1/hbar^2 here so the kernel doesn't have to.
+    """
+    dtype = self.options.dtype
+    scale = 1./const.hbar**2.
+    self._iomegas = (-1.j*self.ham.omegas).astype(dtype)
+    self._Cs_stack = np.array(self.C, dtype=dtype)
+    if self.time_dep:
+      self._Es_stack = np.ascontiguousarray((scale*np.array(self.E)).transpose(1,0,2,3), dtype=dtype)
+      self._Esdag_stack = np.ascontiguousarray((scale*np.array(self.Edag)).transpose(1,0,2,3), dtype=dtype)
+    else:
+      self._Es_stack = (scale*np.array(self.E)).astype(dtype)
+      self._Esdag_stack = (scale*np.array(self.Edag)).astype(dtype)
+
   def rf_eom(self, state, order):
-    dy = (-1.j/const.hbar)*self.ham.commutator(state)
-    for j in range(len(self.E)):
-      dy += (commutator(matmult(self.E[j],state),self.C[j]) + commutator(self.C[j],matmult(state,dag(self.E[j]))))/const.hbar**2.
-    return dy
+    return rf_kernel(self._iomegas, state, self._Cs_stack, self._Es_stack,
+                     self._Esdag_stack)
 
   def super_td_rf_eom(self, state, order):
     return matmult(self.prop[order], state)
 
   def td_rf_eom(self, state, order):
-    dy = (-1.j/const.hbar)*self.ham.commutator(state)
-    for j in range(len(self.E)):
-      dy += (commutator(matmult(self.E[j][order],state),self.C[j]) + commutator(self.C[j],matmult(state,dag(self.E[j][order]))))/const.hbar**2.
-    return dy
-
-  def propagate_eom(self, rho, times):
-
-    rho = self.ham.to_eigenbasis(rho.copy())
+    return rf_kernel(self._iomegas, state, self._Cs_stack, self._Es_stack[order],
+                     self._Esdag_stack[order])
 
+  def prepare_propagation(self, rho, dtype):
+    """Move rho and the expectation operators to the eigenbasis and record
+    the initial trace for check_trace.
+    """
+    rho = self.ham.to_eigenbasis(rho).astype(dtype)
+    # reduced precision has to be checked for trace conservation
+    self._trace_check = np.finfo(self.options.dtype).eps > np.finfo(np.complex128).eps
+    self._trace_0 = np.trace(rho)
     if self.results.e_ops != None:
       for i in range(len(self.results.e_ops)):
         self.results.e_ops[i] = self.ham.to_eigenbasis(self.results.e_ops[i])
+    return rho
+
+  def check_trace(self, state, tau):
+    """Warn once if the trace of a reduced precision state has drifted."""
+    if self._trace_check and abs(np.trace(state)-self._trace_0) > 1.e-5:
+      print_warning("Trace of the density matrix changed by more than 1e-5 at time %.8f, consider using complex128"%(tau))
+      self._trace_check = False
+
+  def propagate_eom(self, rho, times):
+
+    rho = self.prepare_propagation(rho, self.options.dtype)
 
     if self.options.space == "liouville":
-      rho = to_liouville(rho)
+      rho = to_liouville(rho).astype(self.options.dtype)
     elif self.options.space == "hilbert" and self.is_secular:
-      rho_od = rho*(np.ones((self.ham.nstates,self.ham.nstates)) - np.eye(self.ham.nstates))
-      rho = np.diag(rho.copy())
+      rho_od = rho - np.diag(np.diag(rho))
+      rho = np.diag(rho).copy()
+      # full eigenbasis density matrix handed to results
+      rho_eig = np.zeros_like(rho_od)
     self.ode._set_y_value(rho, times[0])
     btime = time()
     td_switch = 1
@@ -438,9 +495,10 @@ class Redfield(Dynamics):
         else:
           if td_switch:
             for j in range(len(self.C)):
-              self.E[j] = list()
-              for k in range(self.ode.order):
-                self.E[j].append(self.gamma_n[j][-1]*self.C[j])
+              self.E[j] = np.array([self.gamma_n[j][-1]*self.C[j]]*self.ode.order)
+              self.Edag[j] = self.E[j].conj().transpose(0,2,1)
+            if self.equation_of_motion == self.td_rf_eom:
+              self.stack_rf_operators()
           td_switch = 0
         if self.options.print_coup_ops:
           for j in range(len(self.E)):
@@ -448,11 +506,15 @@ class Redfield(Dynamics):
       if i%self.results.every==0:
         if self.options.space == "hilbert":
           if self.is_secular:
-            self.results.analyze_state(i, tau, np.diag(self.ode.y)+rho_od)
+            np.copyto(rho_eig, rho_od)
+            np.fill_diagonal(rho_eig, self.ode.y)
+            state = rho_eig
           else:
-            self.results.analyze_state(i, tau, self.ode.y)
+            state = self.ode.y
         elif self.options.space == "liouville":
-          self.results.analyze_state(i, tau, from_liouville(self.ode.y))
+          state = from_liouville(self.ode.y)
+        self.check_trace(state, tau)
+        self.results.analyze_state(i, tau, state)
       if self.is_secular and self.options.space == "hilbert":
         if self.options.method == "exact":
           rho_od *= self.Rdep
@@ -461,11 +523,47 @@ class Redfield(Dynamics):
           for j in range(self.ode.order-1):
             #rho_od *= np.exp((b[j+1]-b[j])*self.dt*self.Rdep[j+1]/const.hbar**2.)
             rho_od *= np.exp((b[j+1]-b[j])*self.dt*self.Rdep/const.hbar**2.)
-          rho_od *= np.exp(-1.j*self.dt*self.ham.omegas)
+          rho_od *= self.exp_omega_step
       self.ode.integrate()
 
     return self.results
 
+  def propagate_eom_adaptive(self, rho, times):
+    """Propagate with scipy's LSODA and an adaptive step size instead of the
+    fixed-step integrator. LSODA only handles real vectors, so the complex
+    state is passed as its real view.
+    """
+    dtype = self.options.dtype
+    rho = self.prepare_propagation(rho, np.complex128)
+    if self.options.space == "liouville":
+      rho = to_liouville(rho)
+    shape = rho.shape
+
+    def fun(t, y):
+      state = y.view(np.complex128).reshape(shape).astype(dtype, copy=False)
+      dy = self.eom(state, 0)
+      return np.ascontiguousarray(dy, dtype=np.complex128).ravel().view(np.float64)
+
+    btime = time()
+    sol = solve_ivp(fun, (times[0],times[-1]), rho.ravel().view(np.float64),
+                    method='LSODA', t_eval=times, atol=self.options.atol,
+                    rtol=self.options.rtol)
+    if not sol.success:
+      print_warning("LSODA failed: %s"%(sol.message))
+    if self.options.verbose:
+      print_basic("%d right-hand side evaluations"%(sol.nfev))
+      print_time(time()-btime)
+
+    for i,tau in enumerate(sol.t):
+      if i%self.results.every==0:
+        state = np.ascontiguousarray(sol.y[:,i]).view(np.complex128).reshape(shape)
+        if self.options.space == "liouville":
+          state = from_liouville(state)
+        self.check_trace(state, tau)
+        self.results.analyze_state(i, tau, state)
+
+    return self.results
+
   def solve(self, rho0, times, eig=True, results=None):
     """Solve the Redfield equations of motion.
     Parameters
@@ -478,10 +576,17 @@ class Redfield(Dynamics):
     -------
     results : Results class
     """
+    if self.options.adaptive:
+      # secular Hilbert-space dynamics are already propagated exactly and
+      # the TCL2 operators live on the fixed time grid
+      if self.time_dep or (self.is_secular and self.options.space == "hilbert"):
+        raise NotImplementedError("adaptive propagation is only implemented for time-independent non-secular or Liouville-space Redfield")
     self.setup(times, results)
     # diagonalize hamiltonian
     if eig:
       self.ham.eigensystem()
+    # free evolution of eigenbasis coherences over one time step
+    self.exp_omega_step = np.exp(-1.j*self.ham.omegas*self.dt)
 
     if self.options.verbose:
       print_stage("Initializing Coupling Operators")
@@ -490,14 +595,21 @@ class Redfield(Dynamics):
       self.coupling_operators_setup()
     else:
       self.make_redfield_operators()
-      if self.options.method == "exact":
+      if self.options.method == "exact" and not self.options.adaptive:
         self.prop = expm(self.dt*self.prop)
       if self.options.space == "hilbert" and self.is_secular:
-        self.Rdep = np.exp(self.dt*(-1.j*self.ham.omegas + self.Rdep/const.hbar**2.))
+        self.Rdep = self.exp_omega_step*np.exp(self.dt*self.Rdep/const.hbar**2.)
+      # keep the propagators in the precision of the state
+      if self.options.space == "liouville" or self.is_secular:
+        self.prop = self.prop.astype(self.options.dtype)
+      if self.options.space == "hilbert" and self.is_secular:
+        self.Rdep = self.Rdep.astype(self.options.dtype)
     if self.options.verbose:
       etime = time()
       print_stage("Finished Constructing Operators")
       print_time(etime-btime)
       print_stage("Propagating Equation of Motion")
 
+    if self.options.adaptive:
+      return self.propagate_eom_adaptive(rho0, times)
     return self.propagate_eom(rho0, times)
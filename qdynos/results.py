@@ -112,11 +112,11 @@ class Results(object):
     """
     Computes expectation values.
     """
+    if normalized:
+      nrm = norm(state)
+    else: nrm = 1.0
     if is_vector(state):
       for i,e_op in enumerate(self.e_ops):
-        if normalized:
-          nrm = norm(state)
-        else: nrm = 1.0
         self.expect[i,ind] = inner(state, matmult(e_op, state)).real/nrm
         #try:
         #  self.expect[i,ind] = matmult(dag(state), e_op, state)[0,0].real/nrm
@@ -126,11 +126,8 @@ class Results(object):
           self.fes.write('%.8f '%(self.expect[i,ind]))
     elif is_matrix(state):
       for i,e_op in enumerate(self.e_ops):
-        if normalized:
-          nrm = norm(state)
-        else: nrm = 1.0
         # TODO sparsify
-        self.expect[i,ind] = np.trace( np.dot(e_op,state) ).real/nrm
+        self.expect[i,ind] = np.einsum('ij,ji->', e_op, state).real/nrm
         if self.print_es:
           self.fes.write('%.8f '%(self.expect[i,ind]))
     else:
@@ -2,6 +2,7 @@ from __future__ import print_function,absolute_import
 
 import numpy as np
 import scipy.sparse as sp
+import scipy.sparse.linalg as spla
 from time import time
 from copy import deepcopy
 from scipy.linalg import expm
@@ -136,6 +137,9 @@ class UnitaryWF(Dynamics):
   def eom_krylov(self, state, order):
     return krylov_prop(self.ham.ham, self.options.nlanczos, state, self.dt, self.options.method, lowmem=self.options.lanczos_lowmem)
 
+  def eom_expm_multiply(self, state, order):
+    return spla.expm_multiply(self.prop, state)
+
   def eom(self, state, order):
     return matmult(self.prop, state)
 
@@ -149,16 +153,23 @@ class UnitaryWF(Dynamics):
     psi = psi0.copy()
 
     if self.options.method == 'exact':
-      if eig:
-        self.ham.eigensystem()
-        for i in range(len(self.results.e_ops)):
-          self.results.e_ops[i] = self.ham.to_eigenbasis(self.results.e_ops[i])
-        psi = self.ham.to_eigenbasis(psi)
-        self.prop = np.diag(np.exp(-(1.j/const.hbar)*self.ham.ev*self.dt))
+      if self.ham.is_sparse:
+        # act with the exponential of the sparse Hamiltonian, never densify it
+        if sp.issparse(psi0):
+          psi = psi0.toarray()
+        self.prop = -(1.j/const.hbar)*self.dt*self.ham.ham
+        ode = Integrator(self.dt, self.eom_expm_multiply, self.options)
       else:
-        psi = psi0
-        self.prop = expm(-(1.j/const.hbar)*self.ham.ham*self.dt)
-      ode = Integrator(self.dt, self.eom, self.options)
+        if eig:
+          self.ham.eigensystem()
+          for i in range(len(self.results.e_ops)):
+            self.results.e_ops[i] = self.ham.to_eigenbasis(self.results.e_ops[i])
+          psi = self.ham.to_eigenbasis(psi)
+          self.prop = np.diag(np.exp(-(1.j/const.hbar)*self.ham.ev*self.dt))
+        else:
+          psi = psi0
+          self.prop = expm(-(1.j/const.hbar)*self.ham.ham*self.dt)
+        ode = Integrator(self.dt, self.eom, self.options)
     elif self.options.method == 'lanczos' or self.options.method == 'arnoldi':
       # check if relevant matrices are csr matrices #
       # ham
@@ -53,8 +53,7 @@ class Hamiltonian(object):
         self.compute_frequencies()
 
     def compute_frequencies(self):
-        self.omegas = np.array([[(self.ev[i]-self.ev[j]) for j in range(self.nstates)]
-                                    for i in range(self.nstates)])/const.hbar
+        self.omegas = (self.ev[:,None] - self.ev[None,:])/const.hbar
 
     def compute_unique_freqs(self):
         self.frequencies = np.unique(self.omegas)
@@ -150,10 +149,14 @@ class MDHamiltonian(Hamiltonian):
                     w,v = np.linalg.eigh(op)
                     coord_list.append( [w,v] )
                 self.coords.append( coord_list.copy() )
+            self.mode_states = [len(coord[0]) for coord in self.coords[0]]
 
     # TODO this needs testing
     def make_adiabatic_transform(self,coords):
         """
+        Returns the nel x nel electronic rotation to the adiabatic basis at
+        the given coordinates. The full transform v (x) 1_modes is never
+        built, adiabatic_populations applies v one grid point at a time.
         """
         S = np.zeros((self.nel,self.nel))
         for i in range(self.nel):
@@ -162,73 +165,71 @@ class MDHamiltonian(Hamiltonian):
         for i in range(self.nel-1):
             for j in range(i+1,self.nel):
                 for k in range(self.nmodes):
-                    S[i,j] += self.coupling[i][j](coords[k])
+                    S[i,j] += self.couplings[i][j](coords[k])
                 S[j,i] = S[i,j]
         w,v = np.linalg.eigh(S)
-        vad = v.copy()
-        for i in range(self.nmodes):
-            vad = np.kron(vad,np.identity(self.mode_states[i]))
-        return vad
+        return v
+
+    def adiabatic_populations(self, i, state):
+        """
+        Population of adiabatic state i on the grid of coordinate eigenvalues
+        of electronic state i, shape mode_states.
+        """
+        dims = list(self.mode_states)
+        nm = self.nmodes
+        if is_vector(state):
+            phi = state.reshape([self.nel] + dims)
+            for j in range(nm):
+                vdag = dag(self.coords[i][j][1])
+                phi = np.moveaxis(np.tensordot(vdag, phi, axes=([1],[j+1])), 0, j+1)
+        else:
+            phi = state.reshape([self.nel] + dims + [self.nel] + dims)
+            for j in range(nm):
+                v = self.coords[i][j][1]
+                phi = np.moveaxis(np.tensordot(dag(v), phi, axes=([1],[j+1])), 0, j+1)
+                phi = np.moveaxis(np.tensordot(phi, v, axes=([nm+j+2],[0])), -1, nm+j+2)
+        pops = np.zeros(dims)
+        for g in np.ndindex(*dims):
+            coords = [self.coords[i][j][0][g[j]] for j in range(nm)]
+            vi = self.make_adiabatic_transform(coords)[:,i]
+            if is_vector(state):
+                da = np.dot(vi.conj(), phi[(slice(None),)+g])
+                pops[g] = (np.conj(da)*da).real
+            else:
+                rho_g = phi[(slice(None),)+g+(slice(None),)+g]
+                pops[g] = np.dot(vi.conj(), np.dot(rho_g, vi)).real
+        return pops
 
-    # TODO this needs testing
     def compute_coordinate_surfaces(self, state):
         """
-        NOTE: Currently only written for 2 modes (minimal conical intersection)
-        probably need to extend with C++/Fortran for more dimensions or for parallelization
-        """ 
+        Probability distribution along each coordinate for each electronic
+        state, i.e. the state in the eigenbasis of the coordinate operator
+        with the electronic state fixed and all other modes traced out.
+        Surfaces are ordered by electronic state, then mode.
+        """
+        dims = list(self.mode_states)
+        nm = self.nmodes
         surfaces = []
-        if is_vector(state):
-            eket = np.zeros((self.nel,1))
-            for i in range(self.nel):
-                eket *= 0.
-                eket[i,0] = 1.
-                for j in range(self.nmodes):
-                    surface = np.zeros(len(self.coords[i][j][0]))
-                    for k,ev in enumerate(self.coords[i][j][0]):
-                        kket = dag(np.array([self.coords[i][j][1][:,k]]))
-                        for l in range(self.nmodes):
-                            if l!=j:
-                                for m,ev2 in enumerate(self.coords[i][l][0]):
-                                    projket = eket.copy()
-                                    mket = dag(np.array([self.coords[i][l][1][:,m]]))
-                                    if l<j:
-                                        projket = np.kron(projket,np.kron(mket,kket))
-                                        coords = [self.coords[i][l][0][m],self.coords[i][j][0][k]]
-                                    elif l>j:
-                                        projket = np.kron(projket,np.kron(kket,mket))
-                                        coords = [self.coords[i][j][0][k],self.coords[i][l][0][m]]
-                                    if self.compute_adiabatic:
-                                        vad = self.make_adiabatic_transform(coords)
-                                        state = np.dot(dag(vad),state)
-                                    da = np.dot(dag(projket),state)[0]
-                                    surface[k] += (np.conj(da)*da).real
-                                    if self.compute_adiabatic:
-                                        state = np.dot(vad,state)
-                    surfaces.append( surface.copy() )
-        elif is_matrix(state):
-            eket = np.zeros((self.nel,1))
-            for i in range(self.nel):
-                eket *= 0.
-                eket[i,0] = 1.
-                for j in range(self.nmodes):
-                    surface = np.zeros(len(self.coords[i][j][0]))
-                    for k,ev in enumerate(self.coords[i][j][0]):
-                        kket = self.coords[i][j][1][:,k]
-                        projket = eket.copy()
-                        for l in range(self.nmodes):
-                            for m,ev2 in enumerate(self.coords[i][l][0]):
-                                mket = self.coords[i][l][1][:,m]
-                                if l<j:
-                                    projket = np.kron(projket,np.kron(mket,kket))
-                                    coords = [self.coords[i][l][0][m],self.coords[i][j][0][k]]
-                                elif l>j:
-                                    projket = np.kron(projket,np.kron(kket,mket))
-                                    coords = [self.coords[i][j][0][k],self.coords[i][l][0][m]]
-                                if self.compute_adiabatic:
-                                    vad = self.make_adiabatic_transform(coords)
-                                    state = np.dot(dag(vad),np.dot(state,vad))
-                                surface[k] += np.dot(dag(projket),np.dot(state,projket))[0,0].real
-                                if self.compute_adiabatic:
-                                    state = np.dot(vad,np.dot(state,dag(vad)))
-                    surfaces.append( surface.copy() )
+        for i in range(self.nel):
+            if self.compute_adiabatic:
+                pops = self.adiabatic_populations(i, state)
+                for j in range(nm):
+                    other = tuple(l for l in range(nm) if l!=j)
+                    surfaces.append( pops.sum(axis=other) )
+            elif is_vector(state):
+                psi = state.reshape([self.nel] + dims)[i]
+                for j in range(nm):
+                    # rotate mode j to the coordinate eigenbasis
+                    phi = np.tensordot(dag(self.coords[i][j][1]), psi, axes=([1],[j]))
+                    surfaces.append( (np.conj(phi)*phi).real.reshape(dims[j],-1).sum(axis=1) )
+            else:
+                rho = state.reshape([self.nel] + dims + [self.nel] + dims)
+                rho = rho[(i,)+(slice(None),)*nm+(i,)]
+                for j in range(nm):
+                    # reduced density matrix of mode j
+                    nrest = int(np.prod(dims))//dims[j]
+                    rho_j = np.moveaxis(rho, [j,nm+j], [0,1]).reshape(dims[j],dims[j],nrest,nrest)
+                    rho_j = np.einsum('abrr->ab', rho_j)
+                    v = self.coords[i][j][1]
+                    surfaces.append( np.einsum('ak,ab,bk->k', v.conj(), rho_j, v).real )
         return surfaces
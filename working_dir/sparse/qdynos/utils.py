@@ -1,3 +1,4 @@
+from functools import reduce
 import numpy as np
 import scipy.sparse as sp
 import scipy.sparse.linalg as spla
@@ -22,12 +23,10 @@ def anticommutator(op1,op2):
     return op1.dot(op2) + op2.dot(op1)
 
 def matmult(*mats):
-    for i,mat in enumerate(mats):
-        if i==0:
-            matout = mat.copy()
-        else:
-            matout = matout.dot(mat)
-    return mat
+    if len(mats) > 2 and all(isinstance(mat, np.ndarray) for mat in mats):
+        # dense chains are contracted in the cheapest order
+        return np.linalg.multi_dot(mats)
+    return reduce(lambda a,b: a.dot(b), mats)
 
 def norm(psi):
     if is_vector(psi):
@@ -50,10 +49,13 @@ def is_hermitian(op):
         raise ValueError('Hermiticity check requires matrix')
 
 def is_vector(vec):
-    return vec.shape[0]!=vec.shape[1]
+    # 1-d arrays, columns and rows, a 1x1 array is treated as a matrix
+    shape = vec.shape
+    return len(shape) == 1 or (shape[0] != shape[1] and 1 in shape)
 
 def is_matrix(mat):
-    return mat.shape[0]==mat.shape[1]
+    shape = mat.shape
+    return len(shape) == 2 and shape[0] == shape[1]
 
 def is_tensor(tensor):
     return (len(tensor.shape)>2)
@@ -63,21 +65,11 @@ def to_liouville(rho):
         # A matrix to a vector
         return rho.flatten().astype(complex)
     else:
-        # A tensor to a matrix 
+        # A tensor to a matrix, rho[i,j,k,l] -> rho_mat[i*ns+j,k*ns+l]
         ns = rho.shape[0]
+        rho_mat = np.ascontiguousarray(rho).reshape(ns*ns,ns*ns).astype(complex, copy=False)
         if sparse_lib:
-            rho_mat = sp.csr_matrix.zeros((ns*ns,ns*ns), dtype=complex)
-        else:
-            rho_mat = np.zeros((ns*ns,ns*ns), dtype=complex)
-        I = 0
-        for i in range(ns):
-            for j in range(ns):
-                J = 0
-                for k in range(ns):
-                    for l in range(ns):
-                        rho_mat[I,J] = rho[i,j,k,l]
-                        J += 1
-                I += 1
+            return sp.csr_matrix(rho_mat)
         return rho_mat
 
 def from_liouville(rho_vec, ns=None):
@@ -11,9 +11,19 @@ from qdynos.options import Options
 def kron(*mats):
     out = mats[0].copy()
     for mat in mats[1:]:
-        out = sp.kron(out,mat)
+        out = sp.kron(out,mat,format='csr')
     return out
 
+def coo_sum(terms, n):
+    """Sum sparse matrices by concatenating their COO triplets. The csr
+    constructor sums duplicate entries, so the sparsity pattern is built once.
+    """
+    terms = [term.tocoo() for term in terms]
+    data = np.concatenate([term.data for term in terms])
+    row = np.concatenate([term.row for term in terms])
+    col = np.concatenate([term.col for term in terms])
+    return sp.csr_matrix((data,(row,col)), shape=(n,n))
+
 def phi(n1,n2=None,nel=None):
     if nel==None:
         phiout = sp.lil_matrix((2,2))
@@ -23,25 +33,21 @@ def phi(n1,n2=None,nel=None):
         phiout[n1,n1] = 1.
     else:
         phiout[n1,n2] = 1.
-    return phiout
+    return phiout.tocsr()
 
 def eye(n, sparse=False):
-    return sp.eye(n, format='lil')
+    return sp.eye(n, format='csr')
 
 def make_ho_q(n):
-    qout = sp.lil_matrix((n,n))
-    for i in range(n-1):
-        qout[i,i+1] = np.sqrt(float(i+1)*0.5)
-        qout[i+1,i] = np.sqrt(float(i+1)*0.5)
-    return qout
+    off = np.sqrt(np.arange(1,n)*0.5)
+    return sp.diags([off,off], [1,-1], format='csr')
 
 def make_ho_h(n,omega,kappa=0.0,q=None):
-    hout = np.diag(np.array([omega*(float(i)+0.5) for i in range(n)]))
-    hout = sp.lil_matrix(hout)
+    hout = sp.diags([omega*(np.arange(n)+0.5)], [0], format='csr')
     if kappa != 0.0:
-        if not q is None:
+        if q is None:
             q = make_ho_q(n)
-        hout += kappa*q
+        hout = hout + kappa*q
     return hout
 
 def construct_sys():
@@ -95,28 +101,24 @@ def construct_sys():
    
     # make full hamiltonian
     print('making full hamiltonian')
+    # identities shared by all electronic-only and single mode terms
+    I_rest = kron(eye(n6a), eye(n1), eye(n9a))
+    I_vib  = kron(eye(n10a), I_rest)
     # energy shift
     print('diag energy')
-    p1 = kron(phi(0),eye(n10a),eye(n6a),eye(n1),eye(n9a))
-    p2 = kron(phi(1),eye(n10a),eye(n6a),eye(n1),eye(n9a))
-    H  = sp.lil_matrix((nstates,nstates))
-    H += -delta*p1
-    H += delta*p2
-    print('mode 10a')
-    H += kron(phi(0), h10a_1   , eye(n6a), eye(n1), eye(n9a))
-    H += kron(phi(1), h10a_2   , eye(n6a), eye(n1), eye(n9a))
-    print('mode 6a')
-    H += kron(phi(0), eye(n10a), h6a_1   , eye(n1), eye(n9a))
-    H += kron(phi(1), eye(n10a), h6a_2   , eye(n1), eye(n9a))
-    print('mode 1')
-    H += kron(phi(0), eye(n10a), eye(n6a), h1_1   , eye(n9a))
-    H += kron(phi(1), eye(n10a), eye(n6a), h1_2   , eye(n9a))
-    print('mode 9a')
-    H += kron(phi(0), eye(n10a), eye(n6a), eye(n1), h9a_1)
-    H += kron(phi(1), eye(n10a), eye(n6a), eye(n1), h9a_1)
+    p1 = kron(phi(0), I_vib)
+    p2 = kron(phi(1), I_vib)
+    terms = [-delta*p1, delta*p2]
+    # sum of single mode hamiltonians for each electronic state,
+    # kronsum(B,A) = A x I + I x B
+    print('vibrational modes')
+    hvib_1 = sp.kronsum(sp.kronsum(sp.kronsum(h9a_1, h1_1), h6a_1), h10a_1, format='csr')
+    hvib_2 = sp.kronsum(sp.kronsum(sp.kronsum(h9a_1, h1_2), h6a_2), h10a_2, format='csr')
+    terms.append( kron(phi(0), hvib_1) )
+    terms.append( kron(phi(1), hvib_2) )
     print('Peierls coupling')
-    H += lamda*kron(phi(0,1), q10a, eye(n6a), eye(n1), eye(n9a))
-    H += lamda*kron(phi(1,0), q10a, eye(n6a), eye(n1), eye(n9a))
+    terms.append( lamda*kron(phi(0,1)+phi(1,0), q10a, I_rest) )
+    H = coo_sum(terms, nstates)
 
     print('making initial wavefunction')
     # initial condition
@@ -139,10 +141,7 @@ def construct_sys():
     psi = kron(psie,psi10a,psi6a,psi1,psi9a)
 
     # convert to csr_matrix
-    H   = sp.csr_matrix(H)
     psi = sp.csr_matrix(psi)
-    p1  = sp.csr_matrix(p1)
-    p2  = sp.csr_matrix(p2)
 
     return H,psi,p1,p2
 